@@ -1,10 +1,20 @@
 from TTS.api import TTS, ModelManager
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Response, request, send_file, jsonify
+import io
 import os
+import re
+import time
 import uuid
 import torch
+import struct
+import numpy as np
+import hashlib
 import logging
+import threading
 import traceback
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
 
 app = Flask(__name__)
 app.debug = True
@@ -21,6 +31,182 @@ model_loaded = False
 # Initialize the model manager
 manager = ModelManager()
 
+# LRU cache of synthesized audio: WAV files live on disk under CACHE_DIR,
+# only the key -> path mapping is kept in memory. 0 entries disables it.
+CACHE_DIR = os.getenv("TTS_CACHE_DIR", "/tmp/tts_cache")
+CACHE_MAX_ENTRIES = max(0, int(os.getenv("TTS_CACHE_MAX_ENTRIES", "512")))
+os.makedirs(CACHE_DIR, exist_ok=True)
+audio_cache = OrderedDict()
+cache_lock = threading.Lock()
+
+# Optional shared cache behind the local one, enabled by setting REDIS_HOST
+REDIS_HOST = os.getenv("REDIS_HOST")
+REDIS_TTL = int(os.getenv("TTS_REDIS_TTL", "86400"))
+# Keep a slow or unreachable Redis from stalling synthesis; a timeout falls through to the model
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", "0.5"))
+# After a Redis error, skip it for this many seconds instead of paying the timeout on every miss
+REDIS_RETRY_AFTER = float(os.getenv("REDIS_RETRY_AFTER", "30"))
+redis_retry_at = 0.0
+redis_client = None
+if REDIS_HOST:
+    import redis
+    redis_client = redis.Redis(host=REDIS_HOST, port=int(os.getenv("REDIS_PORT", "6379")),
+                               socket_connect_timeout=REDIS_TIMEOUT, socket_timeout=REDIS_TIMEOUT)
+
+# Syntheses currently running, keyed like the cache, so duplicate requests can share them
+inflight = {}
+inflight_lock = threading.Lock()
+
+# Limit concurrent inference; a single synthesis already saturates the CPU cores
+infer_semaphore = threading.Semaphore(int(os.getenv("TTS_MAX_CONCURRENCY", "1")))
+
+WHITESPACE_RE = re.compile(r"\s+")
+SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+")
+
+def normalize_for_key(text):
+    # Spacing and Unicode composition differences don't change the spoken audio
+    return WHITESPACE_RE.sub(" ", unicodedata.normalize("NFC", text).strip())
+
+def get_cache_key(text):
+    # Key on everything that changes the rendered audio
+    sample_rate = tts.synthesizer.output_sample_rate
+    key_text = normalize_for_key(text)
+    return hashlib.blake2b(f"{key_text}|{model_name}|{sample_rate}".encode(), digest_size=16).hexdigest()
+
+def cache_open(key):
+    """Open the cached WAV for key, marking it most recently used.
+
+    The file is opened under the cache lock so a concurrent eviction can't
+    remove it before the caller reads it.
+    """
+    with cache_lock:
+        path = audio_cache.get(key)
+        if path is None:
+            return None
+        try:
+            cached_file = open(path, "rb")
+        except FileNotFoundError:
+            del audio_cache[key]
+            return None
+        audio_cache.move_to_end(key)
+        return cached_file
+
+def cache_put(key, path):
+    """Register a synthesized WAV and evict the least recently used entries."""
+    with cache_lock:
+        audio_cache[key] = path
+        audio_cache.move_to_end(key)
+        while len(audio_cache) > CACHE_MAX_ENTRIES:
+            _, old_path = audio_cache.popitem(last=False)
+            try:
+                os.remove(old_path)
+            except OSError as cleanup_error:
+                logging.warning("Failed to remove cached file %s: %s", old_path, cleanup_error)
+
+def redis_available():
+    return redis_client is not None and time.monotonic() >= redis_retry_at
+
+def redis_failed(action, error):
+    global redis_retry_at
+    redis_retry_at = time.monotonic() + REDIS_RETRY_AFTER
+    logging.warning("Redis cache %s failed, skipping Redis for %ss: %s", action, REDIS_RETRY_AFTER, error)
+
+def redis_get(key):
+    if not redis_available():
+        return None
+    try:
+        return redis_client.get(f"tts:{key}")
+    except Exception as e:
+        redis_failed("lookup", e)
+        return None
+
+def redis_put(key, wav_bytes):
+    if not redis_available():
+        return
+    try:
+        redis_client.set(f"tts:{key}", bytes(wav_bytes), ex=REDIS_TTL)
+    except Exception as e:
+        redis_failed("store", e)
+
+# 16-bit mono PCM WAV header; sizes and sample rate are patched in per file
+WAV_HEADER = struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 0, b"WAVE", b"fmt ", 16, 1, 1, 0, 0, 2, 16, b"data", 0)
+
+def wav_header(sample_rate, data_size):
+    header = bytearray(WAV_HEADER)
+    struct.pack_into("<I", header, 4, 36 + data_size)
+    struct.pack_into("<II", header, 24, sample_rate, sample_rate * 2)
+    struct.pack_into("<I", header, 40, data_size)
+    return header
+
+def encode_wav(wav, sample_rate):
+    """Encode float audio as 16-bit mono WAV bytes, peak-normalized like Coqui's save_wav."""
+    wav = np.asarray(wav, dtype=np.float32)
+    data_size = len(wav) * 2
+    buf = bytearray(len(WAV_HEADER) + data_size)
+    buf[:len(WAV_HEADER)] = wav_header(sample_rate, data_size)
+    # Scale straight into the PCM region of the output buffer
+    pcm = np.frombuffer(buf, dtype="<i2", offset=len(WAV_HEADER))
+    np.multiply(wav, 32767 / max(0.01, np.max(np.abs(wav))), out=pcm, casting="unsafe")
+    return buf
+
+def encode_pcm(wav):
+    """Encode float audio as 16-bit PCM at a fixed scale, clipping to [-1, 1]."""
+    wav = np.clip(np.asarray(wav, dtype=np.float32), -1.0, 1.0)
+    return (wav * 32767).astype("<i2").tobytes()
+
+def synthesize_cached(text):
+    """Return a readable WAV file object for text, synthesizing it on a miss.
+
+    Concurrent requests for the same text wait on the first request's
+    synthesis instead of running the model again.
+    """
+    cache_key = get_cache_key(text)
+    with inflight_lock:
+        cached_file = cache_open(cache_key)
+        if cached_file:
+            return cached_file
+        future = inflight.get(cache_key)
+        owner = future is None
+        if owner:
+            future = Future()
+            inflight[cache_key] = future
+    if not owner:
+        return io.BytesIO(future.result())
+
+    output_filename = os.path.join(CACHE_DIR, f"output_{uuid.uuid4()}.wav")
+    cache_path = os.path.join(CACHE_DIR, f"{cache_key}.wav")
+    try:
+        wav_bytes = redis_get(cache_key)
+        if wav_bytes is None:
+            # Synthesize speech
+            logging.info(f"Generating speech for: {text}")
+            print(f"Generating speech for: {text}")
+            with infer_semaphore:
+                wav = tts.tts(text=text)
+            wav_bytes = encode_wav(wav, tts.synthesizer.output_sample_rate)
+            redis_put(cache_key, wav_bytes)
+        if CACHE_MAX_ENTRIES > 0:
+            with open(output_filename, "wb") as output_file:
+                output_file.write(wav_bytes)
+            os.replace(output_filename, cache_path)
+            cache_put(cache_key, cache_path)
+        future.set_result(wav_bytes)
+        return io.BytesIO(wav_bytes)
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        if not future.done():
+            # BaseException (e.g. SystemExit) skipped the handler above; don't leave waiters hanging
+            future.set_exception(RuntimeError("Synthesis was interrupted"))
+        with inflight_lock:
+            del inflight[cache_key]
+        try:
+            if os.path.exists(output_filename):
+                os.remove(output_filename)
+        except Exception as cleanup_error:
+            logging.warning("Failed to remove file %s: %s", output_filename, cleanup_error)
+
 def load_model():
     global tts, model_loaded
     try:
@@ -31,8 +217,22 @@ def load_model():
         model_loaded = False
         logging.error("Error loading model: %s", traceback.format_exc())
 
-# Load the model at startup
+def load_cache_index():
+    """Re-register WAVs left in CACHE_DIR by a previous run, oldest first."""
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, name)
+        if name.startswith("output_"):
+            # Partial output from an interrupted synthesis
+            os.remove(path)
+        elif name.endswith(".wav"):
+            entries.append((os.path.getmtime(path), name[:-len(".wav")], path))
+    for _, key, path in sorted(entries):
+        cache_put(key, path)
+
+# Load the model and the audio cache index at startup
 load_model()
+load_cache_index()
 
 @app.route("/health", methods=["GET"])
 def health_check():
@@ -58,12 +258,13 @@ def synthesize_speech():
     data = request.json
     if not data or "text" not in data:
         return jsonify({"error": "Text not provided"}), 400
+    if not isinstance(data["text"], str):
+        return jsonify({"error": "Text must be a string"}), 400
 
     # Check if 'text' and 'model_name' are provided in the request
     # if not data or "text" not in data or "model_name" not in data:
     #     return jsonify({"error": "Text or model name not provided"}), 400
     text = data["text"]
-    output_filename = f"output_{uuid.uuid4()}.wav"
 # # works but trying a diff way
 #     text = data.get("text")
 #     model_name = data.get("model_name", "tts_models/en/ljspeech/tacotron2-DDC")  # default model
@@ -71,29 +272,56 @@ def synthesize_speech():
 #     output_filename = f"output_{uuid.uuid4()}.wav"
 
     try:
-        # Synthesize speech
-        logging.info(f"Generating speech for: {text}")
-        print(f"Generating speech for: {text}")
-        tts.tts_to_file(text=text, file_path=output_filename)
-
-        # print(f"Generating speech for: {text}")
-        # tts.tts_to_file(text=text, file_path=output_filename)
+        audio_file = synthesize_cached(text)
 
         # Stream the file in chunks as Base64
         # return app.response_class(generate_audio_stream(output_filename),
         #                           mimetype='text/plain')
-        return send_file(output_filename, mimetype="audio/wav", as_attachment=True,
+        return send_file(audio_file, mimetype="audio/wav", as_attachment=True,
                 download_name="synthesized_speech.wav")
 
     except Exception as e:
         print(f"Error in synthesis: {str(e)}")  # Logging the error
         return jsonify({"error": str(e)}), 500
-    finally:
-        try:
-            if os.path.exists(output_filename):
-                os.remove(output_filename)
-        except Exception as cleanup_error:
-            logging.warning("Failed to remove file %s: %s", output_filename, cleanup_error)
+
+@app.route("/synthesize/stream", methods=["POST"])
+def synthesize_speech_stream():
+    """Stream WAV audio sentence by sentence so playback can start after the first one.
+
+    Sentences are encoded at a fixed scale rather than peak-normalized one at a
+    time, so loudness doesn't jump at sentence boundaries. That also means they
+    bypass the cache, whose WAVs are normalized per utterance.
+    """
+    if not model_loaded:
+        return jsonify({"error": "Model is not loaded"}), 503
+
+    data = request.json
+    if not data or "text" not in data:
+        return jsonify({"error": "Text not provided"}), 400
+    if not isinstance(data["text"], str):
+        return jsonify({"error": "Text must be a string"}), 400
+
+    sentences = [sentence for sentence in SENTENCE_SPLIT_RE.split(data["text"].strip()) if sentence]
+    sample_rate = tts.synthesizer.output_sample_rate
+
+    def generate():
+        # Total length is unknown up front; max sizes tell players to read until EOF
+        header = wav_header(sample_rate, 0)
+        struct.pack_into("<I", header, 4, 0xFFFFFFFF)
+        struct.pack_into("<I", header, 40, 0xFFFFFFFF)
+        yield bytes(header)
+        for sentence in sentences:
+            try:
+                logging.info(f"Generating streamed speech for: {sentence}")
+                with infer_semaphore:
+                    wav = tts.tts(text=sentence)
+                yield encode_pcm(wav)
+            except Exception as e:
+                # Headers are already sent, so all we can do is end the stream
+                logging.error("Error in streamed synthesis: %s", e)
+                return
+
+    return Response(generate(), mimetype="audio/wav")
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8082)